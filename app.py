@@ -1,63 +1,144 @@
 # IMPORTS
 
 import numpy as np
-import os, io, json, base64, boto3
+import os, io
+import orjson
+import pybase64
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 from PIL import Image, ImageOps
-from botocore.config import Config
 
 # CONFIG 
 REGION   = os.getenv("AWS_REGION", "us-east-1")
 MODEL_ID = "amazon.nova-canvas-v1:0"
+# resample factors in this range use BICUBIC (4x4 taps) instead of LANCZOS (6x6)
+BICUBIC_SCALE_RANGE = (0.7, 1.5)
 
 # HELPERS 
-def normalize_image(file, force_format: str):
+@st.cache_resource
+def get_bedrock_client():
+    # one client per process: reused across reruns/sessions so the HTTPS pool stays warm.
+    # boto3 is imported here so widget reruns don't pay its import cost.
+    import boto3
+    from botocore.config import Config
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=REGION,
+        config=Config(read_timeout=300, tcp_keepalive=True, retries={"max_attempts": 2}),
+    )
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def normalize_image(raw: bytes, force_format: str):
     """
-    Accepts a JPG/PNG file-like object.
+    Accepts raw JPG/PNG bytes (cached on the bytes + format).
     - Fix EXIF orientation
     - Keep aspect ratio
     - Enforce each side in [320, 4096] (downscale if too big, upscale if tiny)
     - Re-encode to force_format (JPEG or PNG)
     Returns: base64 string
     """
-    img = Image.open(file)
-    img = ImageOps.exif_transpose(img)
+    img = Image.open(io.BytesIO(raw))
 
-    # Size constraints per Nova 
+    # Size constraints per Nova
     min_side, abs_cap = 320, 4096
+    target_max = 3072
+    fmt = force_format.upper()
+
+    # EXIF/XMP orientation without decoding pixels. JPEG keeps both in the header.
+    # PNG's getexif() loads the whole image, and an eXIf chunk may sit after IDAT,
+    # so any PNG that could carry orientation is left to exif_transpose (None)
+    if img.format == "JPEG":
+        orientation = img.getexif().get(0x0112, 1)
+    elif img.format == "PNG":
+        has_meta = b"eXIf" in raw or "xmp" in img.info or "XML:com.adobe.xmp" in img.info
+        orientation = None if has_meta else 1
+    else:
+        orientation = None
+
+    # Already the right format, size and orientation: send the upload as-is
+    # (nothing above decodes pixels, so this skips decode + re-encode)
     w, h = img.size
+    if (img.format == fmt
+            and (fmt != "JPEG" or img.mode == "RGB")
+            and min(w, h) >= min_side and max(w, h) <= target_max
+            and orientation == 1):
+        return pybase64.b64encode_as_string(raw)
 
-    # Cap long side <= 3072 (safe quality, under 4096 hard limit)
-    target_max = 3072
-    long_side = max(w, h)
-    if long_side > target_max:
-        scale = target_max / float(long_side)
-        img = img.resize((int(w*scale), int(h*scale)), Image.LANCZOS)
-        w, h = img.size
-
-    # Ensure short side >= 320 (rare, but makes tiny inputs valid)
-    short_side = min(w, h)
-    if short_side < min_side:
+    # Work out the final size from the header up front so we resample at most once:
+    # cap long side <= 3072 (safe quality, under 4096 hard limit),
+    # then ensure short side >= 320 (rare, but makes tiny inputs valid)
+    long_side, short_side = max(w, h), min(w, h)
+    scale = min(1.0, target_max / float(long_side))
+    if short_side * scale < min_side:
         scale = float(min_side) / float(short_side)
-        new_w, new_h = int(w*scale), int(h*scale)
-        # final safety: never exceed 4096
-        if max(new_w, new_h) > abs_cap:
-            s2 = abs_cap / float(max(new_w, new_h))
-            new_w, new_h = int(new_w*s2), int(new_h*s2)
-        img = img.resize((new_w, new_h), Image.LANCZOS)
+    # final safety: never exceed 4096
+    scale = min(scale, abs_cap / float(long_side))
+
+    # Large JPEGs (incl. multi-picture MPO from phone cameras): let libjpeg decode
+    # at a reduced DCT scale (1/2, 1/4, 1/8) that still covers the final size,
+    # instead of decoding at full resolution
+    if img.format in ("JPEG", "MPO") and scale < 1.0:
+        try:
+            img.draft("RGB", (int(w*scale), int(h*scale)))
+        except Exception:
+            pass
+
+    img = ImageOps.exif_transpose(img)
+
+    # final size in display orientation (a 90-degree EXIF/XMP rotation swaps width/height)
+    new_w, new_h = int(w*scale), int(h*scale)
+    if (img.width < img.height) != (new_w < new_h):
+        new_w, new_h = new_h, new_w
+    if img.size != (new_w, new_h):
+        # big integer-factor shrink: cheap box-filter reduce first, so LANCZOS
+        # only handles the residual (< 2x) factor on a much smaller image
+        # (reduce() rejects P / 1 / I;16 etc.; those go straight to resize)
+        k = min(img.width // new_w, img.height // new_h)
+        if k >= 2 and img.mode in ("L", "LA", "RGB", "RGBA", "CMYK", "I", "F"):
+            img = img.reduce(k)
+        # near-1x factors look the same with BICUBIC at well under half the work
+        lo, hi = BICUBIC_SCALE_RANGE
+        resid = new_w / float(img.width)
+        filt = Image.BICUBIC if lo <= resid <= hi else Image.LANCZOS
+        img = img.resize((new_w, new_h), filt)
 
     # Encode
     buf = io.BytesIO()
-    fmt = force_format.upper()
     if fmt == "JPEG" and img.mode != "RGB":
         img = img.convert("RGB")
     if fmt == "JPEG":
-        img.save(buf, "JPEG", quality=92, optimize=True)
+        # no optimize pass: the extra Huffman pass buys little for a one-shot payload
+        img.save(buf, "JPEG", quality=92)
     else:
-        img.save(buf, "PNG", optimize=True)
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+        # fastest deflate: the payload is sent once and discarded, size barely matters
+        img.save(buf, "PNG", compress_level=1)
+    # drop the decoded pixels before base64 so they don't overlap the encoded payloads,
+    # then encode straight from BytesIO's internal buffer (no intermediate bytes copy)
+    del img
+    with buf.getbuffer() as view:
+        return pybase64.b64encode_as_string(view)
 
-def invoke_vto(source_b64, reference_b64, garment_class, width, height, cfg, seed):
+@st.cache_data(max_entries=8, show_spinner=False)
+def thumb(raw: bytes, max_px: int = 512) -> bytes:
+    """Small JPEG (PNG if transparent) preview for the upload columns (full-res bytes stay in session state)."""
+    im = Image.open(io.BytesIO(raw))
+    im.thumbnail((max_px, max_px), Image.BILINEAR)  # preview only, BILINEAR is plenty
+    im = ImageOps.exif_transpose(im)
+    out = io.BytesIO()
+    if im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info):
+        # keep transparency for cut-out product shots; JPEG would flatten it to black
+        im.convert("RGBA").save(out, "PNG", compress_level=1)
+    else:
+        im.convert("RGB").save(out, "JPEG", quality=82)
+    return out.getvalue()
+
+@st.cache_data(max_entries=32, show_spinner=False, ttl=3600)
+def invoke_vto_cached(source_b64: str, reference_b64: str, garment_class: str,
+                      width: int, height: int, cfg: float, seed: int) -> bytes:
+    """
+    Calls Nova virtual try-on and returns the decoded image bytes.
+    Output is deterministic for fixed inputs + seed, so repeat clicks hit the cache.
+    """
     payload = {
         "taskType": "VIRTUAL_TRY_ON",
         "virtualTryOnParams": {
@@ -74,15 +155,20 @@ def invoke_vto(source_b64, reference_b64, garment_class, width, height, cfg, see
             "seed": int(seed),
         },
     }
-    brt = boto3.client("bedrock-runtime", region_name=REGION, config=Config(read_timeout=300))
+    brt = get_bedrock_client()
     resp = brt.invoke_model(
         modelId=MODEL_ID,
-        body=json.dumps(payload),
+        body=orjson.dumps(payload),  # bytes, no str -> utf-8 recode in botocore
         accept="application/json",
         contentType="application/json",
     )
-    body = json.loads(resp["body"].read())
-    return body["images"][0]  # base64 string
+    body = orjson.loads(resp["body"].read())  # parses bytes directly, no str round-trip
+    return pybase64.b64decode(body["images"][0], validate=False)
+
+def invoke_vto(source_b64, reference_b64, garment_class, width, height, cfg, seed):
+    # normalise arg types so widget values always map to the same cache key
+    return invoke_vto_cached(source_b64, reference_b64, garment_class,
+                             int(width), int(height), float(cfg), int(seed))
 
 
 # STREAMLIT UI
@@ -93,8 +179,13 @@ st.title("Virtual Try-On")
 
 # --- helper: placeholder image for alignment (render ONLY inside result_box) ---
 PLACEHOLDER_PX = 420
+@st.cache_resource
 def placeholder_img():
-    return np.zeros((PLACEHOLDER_PX, PLACEHOLDER_PX, 3), dtype=np.uint8) + 30
+    # pixel-identical every rerun: build + PNG-encode once per process
+    arr = np.full((PLACEHOLDER_PX, PLACEHOLDER_PX, 3), 30, dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, "PNG")
+    return buf.getvalue()
 
 # --- state init ---
 if "person_bytes" not in st.session_state:   st.session_state.person_bytes  = None
@@ -120,7 +211,7 @@ with c1:
             st.session_state.person_name  = _pf.name
             st.rerun()
     else:
-        st.image(st.session_state.person_bytes, use_container_width=True, caption="Person preview")
+        st.image(thumb(st.session_state.person_bytes), use_container_width=True, caption="Person preview")
 
 with c2:
     st.markdown("**Product Image**")
@@ -138,7 +229,7 @@ with c2:
             st.session_state.product_name  = _gf.name
             st.rerun()
     else:
-        st.image(st.session_state.product_bytes, use_container_width=True, caption="Product preview")
+        st.image(thumb(st.session_state.product_bytes), use_container_width=True, caption="Product preview")
 
 with c3:
     st.markdown("**Generated Image**")
@@ -194,22 +285,23 @@ with st.expander("Advanced", expanded=False):
     cfg    = st.slider("CFG scale", 1.0, 15.0, 8.0, step=0.5)
     seed   = st.number_input("Seed", value=0, min_value=0, max_value=10_000)
 
-# --- convert session bytes -> file-like objects for helpers ---
-person_file  = io.BytesIO(st.session_state.person_bytes)  if st.session_state.person_bytes  else None
-product_file = io.BytesIO(st.session_state.product_bytes) if st.session_state.product_bytes else None
+person_bytes  = st.session_state.person_bytes
+product_bytes = st.session_state.product_bytes
 
-run = st.button("Generate Try-On", type="primary", disabled=not(person_file and product_file))
+run = st.button("Generate Try-On", type="primary", disabled=not(person_bytes and product_bytes))
 
 if run:
     try:
         with st.spinner("Encoding & resizing images…"):
-            src_b64 = normalize_image(person_file,  force_format="JPEG")
-            ref_b64 = normalize_image(product_file, force_format="PNG")
+            # independent work; Pillow releases the GIL in decode/resample/encode
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                fut_src = ex.submit(normalize_image, person_bytes,  force_format="JPEG")
+                fut_ref = ex.submit(normalize_image, product_bytes, force_format="PNG")
+                src_b64, ref_b64 = fut_src.result(), fut_ref.result()
 
         with st.spinner("Trying New Product…"):
-            out_b64 = invoke_vto(src_b64, ref_b64, garment_class, width, height, cfg, seed)
+            out_bytes = invoke_vto(src_b64, ref_b64, garment_class, width, height, cfg, seed)
 
-        out_bytes = base64.b64decode(out_b64)
         st.success("Done.")
 
         st.session_state.vto_result_bytes = out_bytes